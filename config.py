@@ -4,12 +4,15 @@ class GlobalConfig:
     EPI_NAME = '/episode_x'
     MAT_SAVE_ROOT = '../out/'
     BLENDER_PATH = 'D:/Program Files/Blender Foundation/Blender 4.2/4.2/python/bin/python.exe' # Your Blender Path
+    MAP_MODEL = 'Town10_2lane.glb' # map model in 3d_model/ (or a cropped one made by matlab/bpy_preprocess.py)
+    VEHICLE_MODEL_DIR = 'Vehicle' # vehicle model folder in 3d_model/ (or a decimated one made by matlab/bpy_preprocess.py)
 
     # 2 Lane Scenario
     MAP_X = [-90, 115]
     MAP_Y = [0, 120]
     bs_location = [26.252628, -86.328842, 21.305660]
     bs_rotation = [-40, 90, 0]
+    radar_height = 5 # radar is mounted below the base station and levelled
     
     '''# 3 Lane Scenario
     MAP_X = [-30, 135]
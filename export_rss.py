@@ -0,0 +1,137 @@
+import argparse
+import os
+import numpy as np
+from scipy.io import loadmat
+import config
+from label_data import list_episodes, list_frames, read_gps, read_network
+
+RAY_COLUMNS = ['vehicle', 'path_loss', 'aod_az', 'aod_el', 'aoa_az', 'aoa_el', 'delay', 'phase_shift',
+               'line_of_sight', 'num_interactions', 'int1_x', 'int1_y', 'int1_z', 'int2_x', 'int2_y', 'int2_z']
+
+def export_episode(_root, _episode, _rays=False):
+    """
+    Consolidate the per-frame network results of one episode into _out_rss/<episode>/.
+    The store holds:
+        rss.npy: float32 (frame, vehicle, beam) RSS in dB, NaN-padded to the largest vehicle count.
+        avg_rss.npy: float32 (frame, beam) per-beam average over vehicles (last row of list_RSS).
+        index.npz: frame numbers, vehicle count per frame, (frame, vehicle) Vehicle_ID, whether
+                   the GPS file matched list_RSS (has_gps; Vehicle_ID is empty otherwise) and
+                   whether each frame was interpolated by keyframe.py.
+        rays.npz: optional compressed sidecar with the ray table of every frame (see RAY_COLUMNS).
+    Only frames with a network result are exported.
+    Args:
+        _root: Root directory of the dataset.
+        _episode: Episode folder name.
+        _rays: Also consolidate the ray geometry saved in _out_rays.
+    Returns:
+        Path of the episode store.
+    """
+    gps_dir = os.path.join(_root, '_out_gps', _episode)
+    net_dir = os.path.join(_root, '_out_net', _episode)
+    frames = list_frames(net_dir, '.csv.mat')
+
+    results = [read_network(os.path.join(net_dir, '%06d.csv.mat' % frame)) for frame in frames]
+    rss = [r[0] for r in results]
+    interpolated = np.array([r[1] for r in results], dtype=bool)
+    num_vehicle = np.array([len(r) - 1 for r in rss], dtype=np.int32)
+    max_vehicle = int(num_vehicle.max()) if len(frames) else 0
+    num_beam = rss[0].shape[1] if len(frames) else 0
+
+    store_dir = os.path.join(_root, '_out_rss', _episode)
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    # Write the RSS tensor directly into a memory-mapped .npy file
+    all_rss = np.lib.format.open_memmap(os.path.join(store_dir, 'rss.npy'), mode='w+', dtype=np.float32,
+                                        shape=(len(frames), max_vehicle, num_beam))
+    all_rss[:] = np.nan
+    avg_rss = np.zeros((len(frames), num_beam), dtype=np.float32)
+    vehicle_id = np.full((len(frames), max_vehicle), '', dtype=object)
+    has_gps = np.zeros(len(frames), dtype=bool)
+    for i, frame in enumerate(frames):
+        all_rss[i, :num_vehicle[i]] = rss[i][:-1]
+        avg_rss[i] = rss[i][-1]
+        # Vehicle IDs are only attached when the GPS rows match the list_RSS rows
+        gps_path = os.path.join(gps_dir, '%06d.csv' % frame)
+        if os.path.isfile(gps_path):
+            ids = read_gps(gps_path)[0]
+            if len(ids) == num_vehicle[i]:
+                vehicle_id[i, :len(ids)] = ids
+                has_gps[i] = True
+    if not has_gps.all():
+        print('Warning: %d frames of %s have no GPS file matching list_RSS, their Vehicle_ID is left empty' %
+              ((~has_gps).sum(), _episode))
+    all_rss.flush()
+    del all_rss
+
+    np.save(os.path.join(store_dir, 'avg_rss.npy'), avg_rss)
+    np.savez(os.path.join(store_dir, 'index.npz'), frame=frames, num_vehicle=num_vehicle,
+             vehicle_id=vehicle_id.astype(str), has_gps=has_gps, interpolated=interpolated)
+
+    if _rays:
+        ray_dir = os.path.join(_root, '_out_rays', _episode)
+        ray_frames = list_frames(ray_dir, '.csv.mat')
+        ray_info = [loadmat(os.path.join(ray_dir, '%06d.csv.mat' % frame),
+                            variable_names=['ray_info'])['ray_info'].reshape(-1, len(RAY_COLUMNS))
+                    for frame in ray_frames]
+        ray_offsets = np.zeros(len(ray_frames) + 1, dtype=np.int64)
+        ray_offsets[1:] = np.cumsum([len(r) for r in ray_info])
+        np.savez_compressed(
+            os.path.join(store_dir, 'rays.npz'),
+            frame=ray_frames,
+            ray_offsets=ray_offsets,
+            ray_info=np.concatenate(ray_info) if ray_info else np.zeros((0, len(RAY_COLUMNS))),
+            columns=np.array(RAY_COLUMNS),
+        )
+
+    print('Exported %s: %d frames, %d vehicles max, %d beams' % (_episode, len(frames), max_vehicle, num_beam))
+    return store_dir
+
+def load_episode(_root, _episode):
+    """
+    Load the RSS store of one episode without reading the whole tensor.
+    Args:
+        _root: Root directory of the dataset.
+        _episode: Episode folder name.
+    Returns:
+        Dictionary with 'rss' (memory-mapped (frame, vehicle, beam) array), 'avg_rss',
+        'frame', 'num_vehicle', 'vehicle_id', 'has_gps' and 'interpolated'.
+    """
+    store_dir = os.path.join(_root, '_out_rss', _episode)
+    index = np.load(os.path.join(store_dir, 'index.npz'))
+    return {
+        'rss': np.load(os.path.join(store_dir, 'rss.npy'), mmap_mode='r'),
+        'avg_rss': np.load(os.path.join(store_dir, 'avg_rss.npy')),
+        'frame': index['frame'],
+        'num_vehicle': index['num_vehicle'],
+        'vehicle_id': index['vehicle_id'],
+        'has_gps': index['has_gps'],
+        'interpolated': index['interpolated'],
+    }
+
+def load_rays(_root, _episode):
+    """
+    Load the ray sidecar of one episode.
+    Returns:
+        Dictionary with 'frame', 'ray_offsets', 'ray_info' and 'columns'. The paths of
+        frame i are rows ray_offsets[i]:ray_offsets[i+1] of ray_info.
+    """
+    with np.load(os.path.join(_root, '_out_rss', _episode, 'rays.npz')) as rays:
+        return {key: rays[key] for key in rays.files}
+
+def main():
+    """
+    Export the RSS store of every episode (or the selected ones) in config.GlobalConfig.SAVE_ROOT.
+    """
+    argparser = argparse.ArgumentParser(description='Consolidate list_RSS into per-episode memory-mappable stores')
+    argparser.add_argument('-e', '--episode', metavar='E', action='append', help='Episode folder to export (default: all)')
+    argparser.add_argument('--rays', action='store_true', help='Also export the ray geometry sidecar')
+    args = argparser.parse_args()
+
+    root = config.GlobalConfig.SAVE_ROOT
+    for episode in args.episode or list_episodes(root):
+        export_episode(root, episode, args.rays)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -196,7 +196,7 @@ def run_sensor(client, world):
     sensor_list.append(lidar)
 
     radar_trans = spawn_trans
-    radar_trans.location.z = 5
+    radar_trans.location.z = config.GlobalConfig.radar_height
     radar_trans.rotation.pitch = 0
     radar = world.spawn_actor(blueprint=radar_bp, transform=radar_trans)
     radar.listen(lambda radar: save_radar(client, world, radar, epsode_name))
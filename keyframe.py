@@ -0,0 +1,213 @@
+import argparse
+import os
+import numpy as np
+from scipy.io import savemat
+import config
+from label_data import beam_labels, list_episodes, list_frames, read_gps, read_network
+
+KEYFRAME_FILE = 'keyframes.txt'  # frames to ray trace, in _out_net/<episode>/
+
+def read_keyframes(net_dir):
+    """
+    Read the keyframe list of an episode.
+    Returns:
+        Set of GPS file names (e.g. '000123.csv') to ray trace, or None if every frame is traced.
+    """
+    path = os.path.join(net_dir, KEYFRAME_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+def select_keyframes(vehicle_ids, positions, threshold=1.0, max_gap=5):
+    """
+    Select the frames to ray trace.
+    A frame is a keyframe when its vehicle set differs from the last keyframe, when a
+    vehicle moved more than threshold meters since the last keyframe, or when max_gap
+    frames passed. The first and last frames are always keyframes. Vehicles are matched
+    by their row, which is stable while the Vehicle_ID sequence is unchanged.
+    Args:
+        vehicle_ids: Vehicle_ID array of every frame.
+        positions: (V, 3) position array of every frame.
+        threshold: Maximum vehicle displacement (m) before a new keyframe.
+        max_gap: Maximum number of frames between keyframes.
+    Returns:
+        Boolean array, True for keyframes.
+    """
+    keyframes = np.zeros(len(vehicle_ids), dtype=bool)
+    last = None
+    for i in range(len(vehicle_ids)):
+        if last is None or i - last >= max_gap or not np.array_equal(vehicle_ids[i], vehicle_ids[last]) or \
+           (len(positions[i]) and np.linalg.norm(positions[i] - positions[last], axis=1).max() > threshold):
+            keyframes[i] = True
+            last = i
+    if len(keyframes):
+        keyframes[-1] = True
+    return keyframes
+
+def interpolate_rss(frames, keyframes, vehicle_ids, keyframe_rss):
+    """
+    Interpolate the RSS of the frames between keyframes.
+    The per-vehicle, per-beam RSS (dB) is interpolated linearly in frame number between
+    the surrounding keyframes when they have the same vehicle set, and held from the
+    previous keyframe otherwise. Frames next to a keyframe without a result are skipped.
+    Args:
+        frames: Frame numbers.
+        keyframes: Boolean keyframe mask.
+        vehicle_ids: Vehicle_ID array of every frame.
+        keyframe_rss: Dictionary frame index -> list_RSS of the traced keyframes.
+    Returns:
+        Dictionary frame index -> interpolated list_RSS (last row is the per-beam average).
+    """
+    result = {}
+    key_index = np.flatnonzero(keyframes)
+    for i in np.flatnonzero(~keyframes):
+        position = np.searchsorted(key_index, i)
+        if position == 0:
+            continue
+        a = key_index[position - 1]
+        b = key_index[position] if position < len(key_index) else None
+        if a not in keyframe_rss or (b is not None and b not in keyframe_rss):
+            continue
+        if not np.array_equal(vehicle_ids[i], vehicle_ids[a]):
+            continue
+        rss = keyframe_rss[a][:-1]
+        if b is not None and np.array_equal(vehicle_ids[b], vehicle_ids[a]):
+            weight = (frames[i] - frames[a]) / (frames[b] - frames[a])
+            rss = (1 - weight) * rss + weight * keyframe_rss[b][:-1]
+        result[i] = np.vstack([rss, rss.mean(axis=0)])
+    return result
+
+def read_episode(root, episode):
+    gps_dir = os.path.join(root, '_out_gps', episode)
+    frames = list_frames(gps_dir, '.csv')
+    gps = [read_gps(os.path.join(gps_dir, '%06d.csv' % frame)) for frame in frames]
+    return frames, [g[0] for g in gps], [g[1] for g in gps]
+
+def select_episode(root, episode, threshold=1.0, max_gap=5):
+    """
+    Write the keyframe list read by network_simulate.m and raytrace_numpy.py, and remove
+    the interpolated results of the frames that became keyframes.
+    """
+    frames, vehicle_ids, positions = read_episode(root, episode)
+    keyframes = select_keyframes(vehicle_ids, positions, threshold, max_gap)
+    net_dir = os.path.join(root, '_out_net', episode)
+    if not os.path.isdir(net_dir):
+        os.makedirs(net_dir)
+    with open(os.path.join(net_dir, KEYFRAME_FILE), 'w') as f:
+        f.writelines('%06d.csv\n' % frame for frame in frames[keyframes])
+    for frame in frames[keyframes]:
+        path = os.path.join(net_dir, '%06d.csv.mat' % frame)
+        if os.path.isfile(path) and read_network(path)[1]:
+            os.remove(path)
+    print('Selected %d keyframes out of %d frames in %s (%.1fx fewer ray traces)' %
+          (keyframes.sum(), len(frames), episode, len(frames) / max(keyframes.sum(), 1)))
+    return keyframes
+
+def interpolate_episode(root, episode):
+    """
+    Save interpolated network results for the frames skipped by the keyframe list.
+    Interpolated .mat files hold list_RSS and interpolated = true. Frames that already
+    have a ray traced result are left untouched, and frames next to a keyframe that has
+    no result yet are not interpolated.
+    """
+    frames, vehicle_ids, _ = read_episode(root, episode)
+    net_dir = os.path.join(root, '_out_net', episode)
+    selected = read_keyframes(net_dir)
+    if selected is None:
+        print('No %s in %s, nothing to interpolate' % (KEYFRAME_FILE, net_dir))
+        return 0
+    keyframes = np.array(['%06d.csv' % frame in selected for frame in frames], dtype=bool)
+    keyframe_rss = {}
+    for i in np.flatnonzero(keyframes):
+        path = os.path.join(net_dir, '%06d.csv.mat' % frames[i])
+        if os.path.isfile(path):
+            keyframe_rss[i] = read_network(path)[0]
+    missing = keyframes.sum() - len(keyframe_rss)
+    if missing:
+        print('Warning: %d keyframes of %s have no network result yet, the frames around them are not interpolated' % (missing, episode))
+
+    interpolated = interpolate_rss(frames, keyframes, vehicle_ids, keyframe_rss)
+    for i in list(interpolated):
+        # Never overwrite a ray traced result
+        path = os.path.join(net_dir, '%06d.csv.mat' % frames[i])
+        if os.path.isfile(path) and not read_network(path)[1]:
+            del interpolated[i]
+            continue
+        savemat(path, {'list_RSS': interpolated[i], 'interpolated': True})
+    print('Interpolated %d frames of %s' % (len(interpolated), episode))
+    return len(interpolated)
+
+def validate_episode(root, episode, thresholds, max_gap=5, num_frames=10):
+    """
+    Measure the interpolation error against full ray tracing for several thresholds.
+    The skipped frames of a sample and their surrounding keyframes are traced with the
+    NumPy backend, so the reported error only comes from the interpolation.
+    """
+    # Imported here because raytrace_numpy.py reads the keyframe list from this module
+    import raytrace_numpy
+    frames, vehicle_ids, positions = read_episode(root, episode)
+    map_grid = raytrace_numpy.UniformGrid(raytrace_numpy.load_glb(
+        os.path.join(raytrace_numpy.MODEL_ROOT, config.GlobalConfig.MAP_MODEL)))
+    vehicle_dir = os.path.join(raytrace_numpy.MODEL_ROOT, config.GlobalConfig.VEHICLE_MODEL_DIR)
+    tapers = raytrace_numpy.load_beam_weights()
+    gps_dir = os.path.join(root, '_out_gps', episode)
+    cache, traced = {}, {}
+
+    def rss(i):
+        if i not in traced:
+            traced[i] = raytrace_numpy.simulate_frame(os.path.join(gps_dir, '%06d.csv' % frames[i]),
+                                                      map_grid, vehicle_dir, cache, tapers)[0]
+        return traced[i]
+
+    print('Interpolation error of %s (%d frames, max gap %d)' % (episode, len(frames), max_gap))
+    for threshold in thresholds:
+        keyframes = select_keyframes(vehicle_ids, positions, threshold, max_gap)
+        skipped = np.flatnonzero(~keyframes)
+        sample = skipped[np.linspace(0, len(skipped) - 1, min(num_frames, len(skipped))).astype(np.int64)] if len(skipped) else skipped
+        key_index = np.flatnonzero(keyframes)
+        needed = {key_index[np.searchsorted(key_index, i) - 1] for i in sample} | \
+                 {key_index[np.searchsorted(key_index, i)] for i in sample}
+        interpolated = interpolate_rss(frames, keyframes, vehicle_ids, {i: rss(i) for i in needed})
+
+        error, best_match = [], []
+        for i in sample:
+            if i not in interpolated:
+                continue
+            predicted = interpolated[i]
+            reference = rss(i)[:-1]
+            error.append(np.abs(predicted[:-1] - reference).ravel())
+            best_match.append(beam_labels(predicted[:-1], 1)[0][:, 0] == beam_labels(reference, 1)[0][:, 0])
+        if error:
+            print('  threshold %.2f m: %d/%d keyframes (%.1fx speedup), RSS error mean %.2f dB, max %.2f dB, best beam agreement %.1f %%' %
+                  (threshold, keyframes.sum(), len(frames), len(frames) / keyframes.sum(),
+                   np.mean(np.concatenate(error)), np.max(np.concatenate(error)), 100 * np.mean(np.concatenate(best_match))))
+        else:
+            print('  threshold %.2f m: %d/%d keyframes, no skipped frame to validate' % (threshold, keyframes.sum(), len(frames)))
+    return
+
+def main():
+    """
+    Select keyframes, interpolate skipped frames or validate the interpolation.
+    """
+    argparser = argparse.ArgumentParser(description='Keyframe ray tracing with RSS interpolation')
+    argparser.add_argument('mode', choices=['select', 'interpolate', 'validate'], help='select: write keyframes.txt before ray tracing, '
+                           'interpolate: fill the skipped frames after ray tracing, validate: report the interpolation error')
+    argparser.add_argument('-e', '--episode', metavar='E', action='append', help='Episode folder (default: all)')
+    argparser.add_argument('-t', '--threshold', metavar='T', nargs='+', default=[1.0], type=float, help='Vehicle displacement threshold in meters (default: 1.0); several values can be validated at once')
+    argparser.add_argument('-g', '--max-gap', metavar='G', default=5, type=int, help='Maximum number of frames between keyframes (default: 5)')
+    argparser.add_argument('-n', '--num-frames', metavar='N', default=10, type=int, help='Skipped frames traced per threshold when validating (default: 10)')
+    args = argparser.parse_args()
+
+    root = config.GlobalConfig.SAVE_ROOT
+    for episode in args.episode or list_episodes(root):
+        if args.mode == 'select':
+            select_episode(root, episode, args.threshold[0], args.max_gap)
+        elif args.mode == 'interpolate':
+            interpolate_episode(root, episode)
+        else:
+            validate_episode(root, episode, args.threshold, args.max_gap, args.num_frames)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.io import loadmat
+from scipy.spatial import cKDTree
+import config
+
+def list_episodes(_root):
+    """
+    List the episode folders produced by generate_data.py.
+    Args:
+        _root: Root directory of the dataset (config.GlobalConfig.SAVE_ROOT).
+    Returns:
+        Sorted list of episode folder names found under _out_gps.
+    """
+    gps_root = os.path.join(_root, '_out_gps')
+    return sorted(name for name in os.listdir(gps_root) if os.path.isdir(os.path.join(gps_root, name)))
+
+def list_frames(_dir, _ext):
+    """
+    List the frame numbers of the files with the given extension in a folder.
+    Args:
+        _dir: Folder containing files named '%06d<_ext>'.
+        _ext: File extension including the dot (e.g. '.csv', '.npy', '.csv.mat').
+    Returns:
+        Sorted int64 array of frame numbers.
+    """
+    if not os.path.isdir(_dir):
+        return np.zeros(0, dtype=np.int64)
+    frames = [int(name[:-len(_ext)]) for name in os.listdir(_dir)
+              if name.endswith(_ext) and name[:-len(_ext)].isdigit()]
+    return np.array(sorted(frames), dtype=np.int64)
+
+def match_frames(_frames, _others, _tol):
+    """
+    Match each frame with the nearest frame of another sensor.
+    Args:
+        _frames: Sorted frame numbers to match.
+        _others: Sorted frame numbers of the other sensor.
+        _tol: Maximum allowed frame difference.
+    Returns:
+        int64 array with the matched frame number, or -1 if none is within _tol.
+    """
+    if len(_others) == 0:
+        return np.full(len(_frames), -1, dtype=np.int64)
+    right = np.clip(np.searchsorted(_others, _frames), 0, len(_others) - 1)
+    left = np.clip(right - 1, 0, len(_others) - 1)
+    nearest = np.where(np.abs(_others[left] - _frames) <= np.abs(_others[right] - _frames),
+                       _others[left], _others[right])
+    return np.where(np.abs(nearest - _frames) <= _tol, nearest, -1)
+
+def rotation_matrix(_rotation):
+    """
+    Build the CARLA rotation matrix for a [pitch, yaw, roll] rotation in degrees.
+    The matrix matches carla.Transform.transform() (x forward, y right, z up).
+    Args:
+        _rotation: [pitch, yaw, roll] in degrees.
+    Returns:
+        A (3, 3) numpy array.
+    """
+    pitch, yaw, roll = np.radians(np.asarray(_rotation, dtype=np.float64))
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cr, sr = np.cos(roll), np.sin(roll)
+    return np.array([
+        [cp * cy, cy * sp * sr - sy * cr, -cy * sp * cr - sy * sr],
+        [cp * sy, sy * sp * sr + cy * cr, -sy * sp * cr + cy * sr],
+        [sp, -cp * sr, cp * cr],
+    ])
+
+def radar_pose():
+    """
+    Get the radar pose used by generate_data.run_sensor.
+    The radar shares the base station transform but is lowered to
+    config.GlobalConfig.radar_height and levelled (pitch = 0).
+    Returns:
+        (location, rotation) as [x, y, z] in CARLA coordinates and [pitch, yaw, roll] in degrees.
+    """
+    location = list(config.GlobalConfig.bs_location)
+    rotation = list(config.GlobalConfig.bs_rotation)
+    location[2] = config.GlobalConfig.radar_height
+    rotation[0] = 0
+    return location, rotation
+
+def radar_to_world(_points, _location, _rotation):
+    """
+    Convert raw radar detections to world coordinates in the GPS convention.
+    This is a vectorized version of utility.calculate_coordinates.
+    Args:
+        _points: (N, 4) array saved by generate_data.save_radar, with columns
+                 [velocity, azimuth, altitude, depth] (angles in radians).
+        _location: Radar location [x, y, z] in CARLA coordinates.
+        _rotation: Radar rotation [pitch, yaw, roll] in degrees.
+    Returns:
+        (N, 3) array of [X, Y, Z] with Y negated like the _out_gps files.
+    """
+    points = np.asarray(_points, dtype=np.float64).reshape(-1, 4)
+    azimuth, altitude, depth = points[:, 1], points[:, 2], points[:, 3]
+    local = np.stack([depth * np.cos(altitude) * np.cos(azimuth),
+                      depth * np.cos(altitude) * np.sin(azimuth),
+                      depth * np.sin(altitude)], axis=1)
+    world = local @ rotation_matrix(_rotation).T + np.asarray(_location, dtype=np.float64)
+    world[:, 1] *= -1  # CARLA y -> GPS Y
+    return world
+
+def associate_points(_points, _vehicles, _max_dist):
+    """
+    Associate world-frame points with the nearest vehicle in the horizontal plane.
+    Args:
+        _points: (N, 3) world points in the GPS convention.
+        _vehicles: (M, 3) vehicle positions [X, Y, Z] of the same frame.
+        _max_dist: Maximum XY distance (m) for a point to be assigned to a vehicle.
+    Returns:
+        (vehicle_index, distance): int32 array with the row index of the vehicle in
+        the frame (-1 if none is within _max_dist) and float32 array of distances.
+    """
+    n = len(_points)
+    if n == 0 or len(_vehicles) == 0:
+        return np.full(n, -1, dtype=np.int32), np.full(n, np.inf, dtype=np.float32)
+    tree = cKDTree(np.asarray(_vehicles)[:, :2])
+    dist, index = tree.query(np.asarray(_points)[:, :2], k=1, distance_upper_bound=_max_dist)
+    index = np.where(np.isfinite(dist), index, -1).astype(np.int32)
+    return index, dist.astype(np.float32)
+
+def beam_labels(_rss, _top_k):
+    """
+    Compute beam labels for every vehicle row of a stacked RSS matrix.
+    Args:
+        _rss: (V, B) RSS in dB (one row per vehicle, one column per beam).
+        _top_k: Number of best beams to keep.
+    Returns:
+        (top_beams, top_rss): (V, _top_k) int16 beam indices sorted from best to
+        worst and the matching (V, _top_k) float32 RSS values.
+    """
+    rss = np.asarray(_rss, dtype=np.float32)
+    k = min(_top_k, rss.shape[1])
+    part = np.argpartition(-rss, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(rss, part, axis=1), axis=1, kind='stable')
+    top_beams = np.take_along_axis(part, order, axis=1)
+    return top_beams.astype(np.int16), np.take_along_axis(rss, top_beams, axis=1)
+
+def read_gps(_path):
+    """
+    Read one _out_gps frame file.
+    Returns:
+        (vehicle_ids, positions, rotations) with positions [X, Y, Z] and rotations [Yaw, Pitch, Roll].
+    """
+    df = pd.read_csv(_path)
+    return (df['Vehicle_ID'].to_numpy(dtype=str),
+            df[['X', 'Y', 'Z']].to_numpy(dtype=np.float32),
+            df[['Yaw', 'Pitch', 'Roll']].to_numpy(dtype=np.float32))
+
+def read_network(_path):
+    """
+    Read a network result saved by network_simulate.m, raytrace_numpy.py or keyframe.py.
+    Returns:
+        (list_RSS, interpolated): list_RSS is a (V + 1, B) array whose last row is the
+        per-beam average over vehicles; interpolated is True when keyframe.py
+        interpolated the frame instead of ray tracing it.
+    """
+    variables = loadmat(_path, variable_names=['list_RSS', 'interpolated'])
+    interpolated = bool(variables['interpolated'].item()) if 'interpolated' in variables else False
+    return variables['list_RSS'], interpolated
+
+def label_episode(_root, _episode, _top_k=3, _max_dist=3.0, _radar_tol=1):
+    """
+    Build the label index of one episode and save it to _out_label/<episode>.npz.
+    Vehicles are identified by their row in the frame's GPS file, which is also
+    their row in list_RSS. Per-vehicle arrays are stored flat and sliced per frame
+    with vehicle_offsets; radar arrays are sliced the same way with radar_offsets.
+    Radar and LiDAR frames are matched to the nearest GPS frame; the camera image of a
+    frame is the GPS frame itself, since both files are named by the image frame.
+    Args:
+        _root: Root directory of the dataset.
+        _episode: Episode folder name.
+        _top_k: Number of best beams to store per vehicle.
+        _max_dist: Maximum XY distance (m) for radar point association.
+        _radar_tol: Maximum frame difference between a GPS frame and its radar or LiDAR frame.
+    Returns:
+        Path of the saved label index.
+    """
+    gps_dir = os.path.join(_root, '_out_gps', _episode)
+    radar_dir = os.path.join(_root, '_out_radar', _episode)
+    lidar_dir = os.path.join(_root, '_out_lidar', _episode)
+    net_dir = os.path.join(_root, '_out_net', _episode)
+
+    frames = list_frames(gps_dir, '.csv')
+    radar_location, radar_rotation = radar_pose()
+
+    vehicle_offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+    radar_offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+    radar_frame = match_frames(frames, list_frames(radar_dir, '.npy'), _radar_tol)
+    lidar_frame = match_frames(frames, list_frames(lidar_dir, '.ply'), _radar_tol)
+    has_rss = np.zeros(len(frames), dtype=bool)
+    interpolated = np.zeros(len(frames), dtype=bool)
+    vehicle_id, position, rotation, rss = [], [], [], []
+    radar_vehicle, radar_dist = [], []
+
+    for i, frame in enumerate(frames):
+        ids, pos, rot = read_gps(os.path.join(gps_dir, '%06d.csv' % frame))
+        vehicle_id.append(ids)
+        position.append(pos)
+        rotation.append(rot)
+        vehicle_offsets[i + 1] = vehicle_offsets[i] + len(ids)
+
+        # Network results are optional: frames without them keep NaN RSS
+        net_path = os.path.join(net_dir, '%06d.csv.mat' % frame)
+        frame_rss = None
+        if os.path.isfile(net_path):
+            frame_rss, interpolated[i] = read_network(net_path)
+            frame_rss = frame_rss[:-1]
+            if len(frame_rss) != len(ids):
+                frame_rss, interpolated[i] = None, False
+        has_rss[i] = frame_rss is not None
+        rss.append(frame_rss)
+
+        points = np.zeros((0, 3))
+        if radar_frame[i] >= 0:
+            points = radar_to_world(np.load(os.path.join(radar_dir, '%06d.npy' % radar_frame[i])),
+                                    radar_location, radar_rotation)
+        index, dist = associate_points(points, pos, _max_dist)
+        radar_vehicle.append(index)
+        radar_dist.append(dist)
+        radar_offsets[i + 1] = radar_offsets[i] + len(index)
+
+    # Stack the RSS of all vehicles so the labels are computed in one pass
+    n_beam = next((len(r[0]) for r in rss if r is not None and len(r)), 0)
+    all_rss = np.full((vehicle_offsets[-1], n_beam), np.nan, dtype=np.float32)
+    for i, frame_rss in enumerate(rss):
+        if frame_rss is not None:
+            all_rss[vehicle_offsets[i]:vehicle_offsets[i + 1]] = frame_rss
+    k = min(_top_k, n_beam)
+    if n_beam:
+        top_beams, top_rss = beam_labels(np.nan_to_num(all_rss, nan=-np.inf), k)
+        top_beams[~np.isfinite(top_rss)] = -1
+    else:
+        top_beams = np.zeros((len(all_rss), 0), dtype=np.int16)
+        top_rss = np.zeros((len(all_rss), 0), dtype=np.float32)
+
+    label_dir = os.path.join(_root, '_out_label')
+    if not os.path.isdir(label_dir):
+        os.makedirs(label_dir)
+    out_path = os.path.join(label_dir, _episode + '.npz')
+    np.savez_compressed(
+        out_path,
+        frame=frames,
+        has_rss=has_rss,
+        interpolated=interpolated,
+        radar_frame=radar_frame,
+        lidar_frame=lidar_frame,
+        vehicle_offsets=vehicle_offsets,
+        vehicle_id=np.concatenate(vehicle_id) if vehicle_id else np.zeros(0, dtype=str),
+        position=np.concatenate(position) if position else np.zeros((0, 3), dtype=np.float32),
+        rotation=np.concatenate(rotation) if rotation else np.zeros((0, 3), dtype=np.float32),
+        best_beam=top_beams[:, 0] if k else np.zeros(len(all_rss), dtype=np.int16),
+        top_beams=top_beams,
+        top_rss=top_rss,
+        radar_offsets=radar_offsets,
+        radar_vehicle=np.concatenate(radar_vehicle) if radar_vehicle else np.zeros(0, dtype=np.int32),
+        radar_dist=np.concatenate(radar_dist) if radar_dist else np.zeros(0, dtype=np.float32),
+    )
+    print('Labeled %s: %d frames, %d vehicles, %d radar points' %
+          (_episode, len(frames), vehicle_offsets[-1], radar_offsets[-1]))
+    return out_path
+
+def main():
+    """
+    Label every episode (or the selected ones) of the dataset in config.GlobalConfig.SAVE_ROOT.
+    """
+    argparser = argparse.ArgumentParser(description='Build per-episode beam label indexes')
+    argparser.add_argument('-e', '--episode', metavar='E', action='append', help='Episode folder to label (default: all)')
+    argparser.add_argument('-k', '--top-k', metavar='K', default=3, type=int, help='Number of best beams to store (default: 3)')
+    argparser.add_argument('--max-dist', metavar='D', default=3.0, type=float, help='Maximum radar-to-vehicle distance in meters (default: 3.0)')
+    argparser.add_argument('-j', '--workers', metavar='J', default=1, type=int, help='Number of episodes labeled in parallel (default: 1)')
+    args = argparser.parse_args()
+
+    root = config.GlobalConfig.SAVE_ROOT
+    episodes = args.episode or list_episodes(root)
+    if args.workers > 1:
+        with ProcessPoolExecutor(args.workers) as pool:
+            list(pool.map(label_episode, [root] * len(episodes), episodes,
+                          [args.top_k] * len(episodes), [args.max_dist] * len(episodes)))
+    else:
+        for episode in episodes:
+            label_episode(root, episode, args.top_k, args.max_dist)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-function [rays, tx, txArray, num_vehicle, bsArrayOrientation] = GetNetworkInfo(gpsEpiPath, inputfilename, mapname, txPos, bsArrayOrientation)
+function [rays, tx, txArray, num_vehicle, bsArrayOrientation, trace_time] = GetNetworkInfo(gpsEpiPath, inputfilename, mapname, txPos, bsArrayOrientation)
     % This function calculates network information using ray tracing.
     % Inputs:
     % - gpsEpiPath: Path to the GPS data directory
@@ -12,6 +12,7 @@ function [rays, tx, txArray, num_vehicle, bsArrayOrientation] = GetNetworkInfo(g
     % - txArray: Transmitter antenna array
     % - num_vehicle: Number of vehicles in the simulation
     % - bsArrayOrientation: Orientation of the base station antenna
+    % - trace_time: Ray tracing time in seconds
     
     % Load GPS data from the input file
     gpsfilePath = fullfile(gpsEpiPath, inputfilename);
@@ -89,9 +90,10 @@ function [rays, tx, txArray, num_vehicle, bsArrayOrientation] = GetNetworkInfo(g
     end
     
     % Perform ray tracing between the transmitter and receivers
-    tic
+    traceTimer = tic;
     rays = raytrace(tx, rx, pm, Type="power");
-    toc
+    trace_time = toc(traceTimer);
+    fprintf('Ray tracing: %.3f s\n', trace_time);
     
     % Close the site viewer
     viewer.close
@@ -4,7 +4,7 @@ import os
 import math
 import gc
 
-def merge_glb_files(file1_path, output_path, obj_models, obj_locations, obj_rotations):
+def merge_glb_files(file1_path, output_path, obj_models, obj_locations, obj_rotations, vehicle_dir='Vehicle'):
     # Define the path to the 3D model directory
     mapfile_path = "../3d_model/"
     
@@ -21,8 +21,8 @@ def merge_glb_files(file1_path, output_path, obj_models, obj_locations, obj_rota
         # Deselect all objects in the scene
         bpy.ops.object.select_all(action='DESELECT')
 
-        # Import the next GLB file (e.g., a vehicle model)
-        glb_file_2 = mapfile_path + 'Vehicle/' + obj_models[iter] + '.glb'
+        # Import the next GLB file (e.g., a vehicle model, possibly a decimated one from bpy_preprocess.py)
+        glb_file_2 = mapfile_path + vehicle_dir + '/' + obj_models[iter] + '.glb'
         bpy.ops.import_scene.gltf(filepath=glb_file_2)
 
         # Move and rotate the imported objects based on the provided location and rotation
@@ -46,7 +46,7 @@ def merge_glb_files(file1_path, output_path, obj_models, obj_locations, obj_rota
     # Quit Blender after processing
     bpy.ops.wm.quit_blender()
 
-def main(datapath, filename, modelname, output_file):
+def main(datapath, filename, modelname, output_file, vehicle_dir='Vehicle'):
     # Define the path to the original GLB file
     orgfile = "../3d_model/" + modelname
     # Define the directory path for the input data
@@ -65,7 +65,7 @@ def main(datapath, filename, modelname, output_file):
     rotations = [[df.iloc[iter, 5:6].values[0], df.iloc[iter, 6:7].values[0], df.iloc[iter, 7:8].values[0]] for iter in range(num_rows)]
 
     # Call the function to merge GLB files
-    merge_glb_files(orgfile, output_file, models, locations, rotations)
+    merge_glb_files(orgfile, output_file, models, locations, rotations, vehicle_dir)
     
     # Manually invoke Python's garbage collector to free memory
     gc.collect()
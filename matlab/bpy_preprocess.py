@@ -0,0 +1,176 @@
+import bpy
+import bmesh
+import mathutils
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import config
+
+MODEL_ROOT = "../3d_model/"
+CACHE_DIR = "cache/"
+
+def file_hash(file_path):
+    # Hash the source file so cached geometry is rebuilt when it changes
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()[:12]
+
+def params_hash(params):
+    # Short hash of the processing parameters, part of the cache key
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+
+def clear_scene():
+    # Delete all objects and free orphaned data before importing a new file
+    bpy.ops.object.select_all(action='SELECT')
+    bpy.ops.object.delete(use_global=False)
+    bpy.ops.outliner.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+
+def count_triangles(objects):
+    # Count the triangles of all mesh objects (an n-gon counts as n - 2 triangles)
+    return sum(len(p.vertices) - 2 for obj in objects if obj.type == 'MESH' for p in obj.data.polygons)
+
+def crop_map(file_path, output_path, x_range, y_range):
+    # Keep only the faces whose XY bounding box overlaps the XY box
+    clear_scene()
+    bpy.ops.import_scene.gltf(filepath=file_path)
+    meshes = [obj for obj in bpy.context.scene.objects if obj.type == 'MESH']
+    before = count_triangles(meshes)
+
+    for obj in meshes:
+        # Drop whole objects whose bounding box is outside the box
+        corners = [obj.matrix_world @ mathutils.Vector(c) for c in obj.bound_box]
+        if max(c.x for c in corners) < x_range[0] or min(c.x for c in corners) > x_range[1] or \
+           max(c.y for c in corners) < y_range[0] or min(c.y for c in corners) > y_range[1]:
+            bpy.data.objects.remove(obj, do_unlink=True)
+            continue
+
+        # Copy mesh data shared with other objects so cropping one does not crop the others
+        if obj.data.users > 1:
+            obj.data = obj.data.copy()
+        bm = bmesh.new()
+        bm.from_mesh(obj.data)
+        world = {v: obj.matrix_world @ v.co for v in bm.verts}
+        outside_faces = []
+        for f in bm.faces:
+            xs = [world[v].x for v in f.verts]
+            ys = [world[v].y for v in f.verts]
+            if max(xs) < x_range[0] or min(xs) > x_range[1] or max(ys) < y_range[0] or min(ys) > y_range[1]:
+                outside_faces.append(f)
+        if outside_faces:
+            bmesh.ops.delete(bm, geom=outside_faces, context='FACES')
+            bm.to_mesh(obj.data)
+        bm.free()
+        if len(obj.data.polygons) == 0:
+            bpy.data.objects.remove(obj, do_unlink=True)
+
+    after = count_triangles(bpy.context.scene.objects)
+    bpy.ops.export_scene.gltf(filepath=output_path, export_format='GLB')
+    return before, after
+
+def decimate_model(file_path, output_path, budget):
+    # Collapse-decimate every mesh of a model so the whole model fits in the triangle budget
+    clear_scene()
+    bpy.ops.import_scene.gltf(filepath=file_path)
+    meshes = [obj for obj in bpy.context.scene.objects if obj.type == 'MESH']
+    before = count_triangles(meshes)
+    ratio = min(1.0, budget / max(before, 1))
+
+    if ratio < 1.0:
+        for obj in meshes:
+            modifier = obj.modifiers.new(name='Decimate', type='DECIMATE')
+            modifier.decimate_type = 'COLLAPSE'
+            modifier.ratio = ratio
+        # Bake the modifiers into the meshes
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        for obj in meshes:
+            obj.data = bpy.data.meshes.new_from_object(obj.evaluated_get(depsgraph))
+            obj.modifiers.clear()
+
+    after = count_triangles(meshes)
+    bpy.ops.export_scene.gltf(filepath=output_path, export_format='GLB')
+    return before, after
+
+def load_manifest(manifest_path):
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+def save_manifest(manifest_path, manifest):
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def prepare_map(modelname, x_range, y_range):
+    # Return the cropped map (relative to MODEL_ROOT), building it if it is not cached
+    src = MODEL_ROOT + modelname
+    params = {'x': list(x_range), 'y': list(y_range)}
+    stem = os.path.splitext(os.path.basename(modelname))[0]
+    name = CACHE_DIR + "%s_%s_%s.glb" % (stem, file_hash(src), params_hash(params))
+
+    manifest_path = MODEL_ROOT + CACHE_DIR + "manifest.json"
+    manifest = load_manifest(manifest_path)
+    if not os.path.isfile(MODEL_ROOT + name):
+        os.makedirs(MODEL_ROOT + CACHE_DIR, exist_ok=True)
+        before, after = crop_map(src, MODEL_ROOT + name, x_range, y_range)
+        manifest[name] = {'source': modelname, 'params': params, 'triangles': [before, after]}
+        save_manifest(manifest_path, manifest)
+    before, after = manifest.get(name, {}).get('triangles', [0, 0])
+    print("Map %s -> %s: %d -> %d triangles" % (modelname, name, before, after))
+    return name
+
+def prepare_vehicles(vehicle_dir, budget):
+    # Return the decimated vehicle folder (relative to MODEL_ROOT), rebuilding changed models only
+    name = CACHE_DIR + "%s_%d" % (vehicle_dir.strip('/'), budget)
+    os.makedirs(MODEL_ROOT + name, exist_ok=True)
+
+    manifest_path = MODEL_ROOT + name + "/manifest.json"
+    manifest = load_manifest(manifest_path)
+    total_before, total_after = 0, 0
+    for filename in sorted(os.listdir(MODEL_ROOT + vehicle_dir)):
+        if not filename.endswith('.glb'):
+            continue
+        src = MODEL_ROOT + vehicle_dir + "/" + filename
+        key = file_hash(src)
+        entry = manifest.get(filename)
+        if entry is None or entry['hash'] != key or not os.path.isfile(MODEL_ROOT + name + "/" + filename):
+            before, after = decimate_model(src, MODEL_ROOT + name + "/" + filename, budget)
+            entry = {'hash': key, 'triangles': [before, after]}
+            manifest[filename] = entry
+            save_manifest(manifest_path, manifest)
+        print("  %s: %d -> %d triangles" % (filename, *entry['triangles']))
+        total_before += entry['triangles'][0]
+        total_after += entry['triangles'][1]
+    print("Vehicles %s -> %s: %d -> %d triangles" % (vehicle_dir, name, total_before, total_after))
+    return name
+
+def main(modelname, vehicle_dir, x_range, y_range, bs_location, margin, budget):
+    # Crop the region covering the map boundaries and the base station, plus a margin for reflectors
+    x_range = [min(x_range[0], bs_location[0]) - margin, max(x_range[1], bs_location[0]) + margin]
+    y_range = [min(y_range[0], bs_location[1]) - margin, max(y_range[1], bs_location[1]) + margin]
+    map_name = prepare_map(modelname, x_range, y_range)
+    vehicle_name = prepare_vehicles(vehicle_dir, budget) if budget > 0 else vehicle_dir
+    print("Use MAP_MODEL = '%s' and VEHICLE_MODEL_DIR = '%s' in config.py" % (map_name, vehicle_name))
+    return map_name, vehicle_name
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Crop the map and decimate the vehicle models for ray tracing')
+    argparser.add_argument('--map', default='Town10_2lane.glb', help='Map model in ../3d_model/ (default: Town10_2lane.glb)')
+    argparser.add_argument('--vehicles', default='Vehicle', help='Vehicle model folder in ../3d_model/ (default: Vehicle)')
+    argparser.add_argument('--x', nargs=2, type=float, help='Override the X range (default: MAP_X of config.py)')
+    argparser.add_argument('--y', nargs=2, type=float, help='Override the Y range (default: MAP_Y of config.py)')
+    argparser.add_argument('--bs', nargs=2, type=float, help='Override the base station X and Y, Y negated like the GPS data (default: bs_location of config.py)')
+    argparser.add_argument('--margin', type=float, default=20.0, help='Margin in meters around the region (default: 20)')
+    argparser.add_argument('--budget', type=int, default=2000, help='Triangle budget per vehicle model, 0 to keep the originals (default: 2000)')
+    args = argparser.parse_args(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:])
+    bs_location = config.GlobalConfig.bs_location
+    main(args.map, args.vehicles,
+         args.x or config.GlobalConfig.MAP_X,
+         args.y or config.GlobalConfig.MAP_Y,
+         args.bs or [bs_location[0], -bs_location[1]],
+         args.margin, args.budget)
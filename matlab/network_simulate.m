@@ -1,4 +1,16 @@
-function [] = network_simulate(saveroot, blenderpath, txPos, bsArrayOrientation)
+function [] = network_simulate(saveroot, blenderpath, txPos, bsArrayOrientation, saveRays, mapname, vehicledir)
+    % Ray geometry is saved to a separate sidecar file unless disabled
+    if nargin < 5
+        saveRays = true;
+    end
+    % Map model and vehicle model folder in 3d_model/ (cropped/decimated ones come from bpy_preprocess.py)
+    if nargin < 6
+        mapname = "Town10_2lane.glb";
+    end
+    if nargin < 7
+        vehicledir = "Vehicle";
+    end
+
     % Transpose the transmitter position and base station orientation for compatibility
     txPos = txPos.';
     bsArrayOrientation = bsArrayOrientation.';
@@ -24,15 +36,26 @@ function [] = network_simulate(saveroot, blenderpath, txPos, bsArrayOrientation)
     for i = 1:length(subFolders)
         gpsEpiPath = gpsPath + subFolders(i).name; % Path to GPS data for the current episode
         netEpiPath = folderPath + "\_out_net\" + subFolders(i).name; % Path to save network data
+        rayEpiPath = folderPath + "\_out_rays\" + subFolders(i).name; % Path to save ray geometry
 
-        % Create the network output folder if it doesn't exist
+        % Create the network output folders if they don't exist
         if ~isfolder(netEpiPath)
             mkdir(netEpiPath);
         end
+        if saveRays && ~isfolder(rayEpiPath)
+            mkdir(rayEpiPath);
+        end
 
         % Get the list of CSV files in the current GPS folder
         csvFiles = dir(fullfile(gpsEpiPath, '*.csv'));
 
+        % Only trace the keyframes if keyframe.py selected them (the other frames are interpolated)
+        keyframeFile = netEpiPath + "\keyframes.txt";
+        if isfile(keyframeFile)
+            keyframes = splitlines(strtrim(string(fileread(keyframeFile))));
+            csvFiles = csvFiles(ismember(string({csvFiles.name}), keyframes));
+        end
+
         % Process each CSV file in the folder
         for k = 1:length(csvFiles)
             inputfilename = string(csvFiles(k).name);
@@ -46,13 +69,23 @@ function [] = network_simulate(saveroot, blenderpath, txPos, bsArrayOrientation)
             % Combine 3D map data using Blender
             tic
             py.bpy_combine.main(saveroot, string(subFolders(i).name) + "/" + inputfilename, ...
-                                "Town10_2lane.glb", "temp_map.glb");
+                                mapname, "temp_map.glb", vehicledir);
             toc
 
             % Perform ray tracing and network simulation
-            [rays_result, ~, txArray, num_vehicle, bsArrayOrientation] = ...
+            [rays_result, ~, txArray, num_vehicle, bsArrayOrientation, trace_time] = ...
                 GetNetworkInfo(gpsEpiPath, inputfilename, "temp_map.glb", txPos, bsArrayOrientation);
 
+            % Log the ray tracing time to compare full and preprocessed geometry
+            logFile = netEpiPath + "\trace_time.csv";
+            isNewLog = ~isfile(logFile);
+            fid = fopen(logFile, 'a');
+            if isNewLog
+                fprintf(fid, 'Frame,Map,Vehicles,NumVehicle,TraceTime\n');
+            end
+            fprintf(fid, '%s,%s,%s,%d,%.4f\n', inputfilename, mapname, vehicledir, num_vehicle(1), trace_time);
+            fclose(fid);
+
             % Initialize variables for RSS (Received Signal Strength) calculation
             tic
             list_RSS = zeros(num_vehicle(1) + 1, length(weight_list)); % RSS values for each beam
@@ -119,10 +152,35 @@ function [] = network_simulate(saveroot, blenderpath, txPos, bsArrayOrientation)
                 end
             end
 
-            % Save the results to a .mat file
+            % Save the RSS results to a .mat file
             fprintf('Done and Save: %s\n', fullfile(netEpiPath + "\" + inputfilename + ".mat"));
-            save(fullfile(netEpiPath + "\" + inputfilename + ".mat"), 'rays_result', 'list_RSS');
+            save(fullfile(netEpiPath + "\" + inputfilename + ".mat"), 'list_RSS');
+
+            % Save the ray geometry to a separate compressed sidecar file
+            if saveRays
+                ray_info = RayTable(rays_result);
+                save(fullfile(rayEpiPath + "\" + inputfilename + ".mat"), 'rays_result', 'ray_info', '-v7');
+            end
             toc
         end
     end
-end
\ No newline at end of file
+end
+
+function ray_info = RayTable(rays_result)
+    % Flatten ray tracing results into a numeric table with one row per path:
+    % [vehicle, path loss, AoD az, AoD el, AoA az, AoA el, delay, phase shift,
+    %  line of sight, number of interactions, 1st interaction xyz, 2nd interaction xyz]
+    ray_info = zeros(0, 16);
+    for i_v = 1:length(rays_result)
+        for i_ray = 1:length(rays_result{i_v})
+            ray = rays_result{i_v}(1, i_ray);
+            interactions = nan(1, 6);
+            for i_int = 1:min(ray.NumInteractions, 2)
+                interactions(3*i_int-2:3*i_int) = ray.Interactions(i_int).Location.';
+            end
+            ray_info(end+1, :) = [i_v, ray.PathLoss, ray.AngleOfDeparture.', ray.AngleOfArrival.', ...
+                                  ray.PropagationDelay, ray.PhaseShift, ray.LineOfSight, ...
+                                  ray.NumInteractions, interactions]; %#ok<AGROW>
+        end
+    end
+end
@@ -1,7 +1,7 @@
 import matlab.engine
 import config
 
-def do_matlab():
+def do_matlab(save_rays=True):
     # Start MATLAB engine
     eng = matlab.engine.start_matlab()
     
@@ -24,10 +24,15 @@ def do_matlab():
     # - BLENDER_PATH: Path to Blender files
     # - bs_location: Adjusted base station location
     # - bs_rotation: Adjusted base station rotation
+    # - save_rays: Save the ray geometry to the _out_rays sidecar files
+    # - MAP_MODEL, VEHICLE_MODEL_DIR: Map model and vehicle model folder in 3d_model/
     eng.network_simulate(config.GlobalConfig.MAT_SAVE_ROOT,
                     config.GlobalConfig.BLENDER_PATH,
                     matlab.double(bs_location)[0],
                     matlab.double(bs_rotation)[0],
+                    save_rays,
+                    config.GlobalConfig.MAP_MODEL,
+                    config.GlobalConfig.VEHICLE_MODEL_DIR,
                     nargout=0)
 
     # Close the MATLAB engine after execution
@@ -0,0 +1,599 @@
+import argparse
+import json
+import os
+import struct
+import time
+import numpy as np
+import pandas as pd
+from scipy.io import loadmat, savemat
+import config
+from export_rss import RAY_COLUMNS
+from keyframe import read_keyframes
+from label_data import beam_labels, list_episodes, list_frames, read_network
+
+MODEL_ROOT = './3d_model/'
+BEAM_WEIGHTS = './matlab/beam_weights.mat'
+LIGHT_SPEED = 299792458.0
+
+# Receiver height offset above the vehicle location, as in GetNetworkInfo.m
+VEHICLE_HEIGHT = {
+    'vehicle.audi.a2': 1.7, 'vehicle.audi.etron': 1.8, 'vehicle.audi.tt': 1.6,
+    'vehicle.bmw.grandtourer': 1.7, 'vehicle.carlamotors.carlacola': 2.6,
+    'vehicle.carlamotors.firetruck': 4.0, 'vehicle.chevrolet.impala': 1.5,
+    'vehicle.citroen.c3': 1.7, 'vehicle.dodge.charger_2020': 1.7,
+    'vehicle.dodge.charger_police': 1.7, 'vehicle.ford.ambulance': 1.6,
+    'vehicle.ford.mustang': 1.4, 'vehicle.lincoln.mkz_2017': 1.7,
+    'vehicle.lincoln.mkz_2020': 1.7, 'vehicle.mercedes.coupe': 1.8,
+    'vehicle.mercedes.coupe_2020': 1.6, 'vehicle.micro.microlino': 1.5,
+    'vehicle.mini.cooper_s': 1.6, 'vehicle.mini.cooper_s_2021': 1.8,
+    'vehicle.mitsubishi.fusorosa': 4.5, 'vehicle.nissan.micra': 1.7,
+    'vehicle.nissan.patrol': 2.0, 'vehicle.nissan.patrol_2021': 2.2,
+    'vehicle.seat.leon': 1.6, 'vehicle.tesla.cybertruck': 2.3,
+    'vehicle.toyota.prius': 1.6, 'vehicle.volkswagen.t2': 2.2,
+}
+DEFAULT_HEIGHT = 2
+
+# ITU-R P.2040 concrete parameters (relative permittivity a * f^b, conductivity c * f^d, f in GHz)
+CONCRETE = (5.24, 0.0, 0.0462, 0.7822)
+
+GLTF_COMPONENT = {5120: np.int8, 5121: np.uint8, 5122: np.int16, 5123: np.uint16, 5125: np.uint32, 5126: np.float32}
+GLTF_SIZE = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT4': 16}
+
+def read_accessor(gltf, binary, index):
+    """
+    Read a glTF accessor from the binary chunk of a GLB file.
+    """
+    accessor = gltf['accessors'][index]
+    if 'sparse' in accessor or 'bufferView' not in accessor:
+        raise ValueError('Sparse glTF accessors are not supported')
+    view = gltf['bufferViews'][accessor['bufferView']]
+    dtype = np.dtype(GLTF_COMPONENT[accessor['componentType']])
+    size = GLTF_SIZE[accessor['type']]
+    offset = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    stride = view.get('byteStride', dtype.itemsize * size)
+    count = accessor['count']
+    raw = np.frombuffer(binary, dtype=np.uint8, count=stride * (count - 1) + dtype.itemsize * size, offset=offset)
+    rows = np.lib.stride_tricks.as_strided(raw, shape=(count, dtype.itemsize * size), strides=(stride, 1))
+    return np.ascontiguousarray(rows).view(dtype).reshape(count, size)
+
+def node_matrix(node):
+    """
+    Get the local 4x4 transform of a glTF node.
+    """
+    if 'matrix' in node:
+        return np.array(node['matrix'], dtype=np.float64).reshape(4, 4).T
+    x, y, z, w = node.get('rotation', [0, 0, 0, 1])
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * np.array(node.get('scale', [1, 1, 1]))
+    matrix[:3, 3] = node.get('translation', [0, 0, 0])
+    return matrix
+
+def load_glb(path):
+    """
+    Load the triangles of a GLB file.
+    glTF is Y-up; triangles are converted to the Z-up frame used by Blender and MATLAB,
+    i.e. the GPS convention (X, Y negated from CARLA, Z).
+    Args:
+        path: Path to the .glb file.
+    Returns:
+        (T, 3, 3) float64 array of triangle vertices.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, _, length = struct.unpack_from('<4sII', data, 0)
+    if magic != b'glTF':
+        raise ValueError('%s is not a GLB file' % path)
+    gltf, binary, offset = None, b'', 12
+    while offset < length:
+        chunk_length, chunk_type = struct.unpack_from('<II', data, offset)
+        chunk = data[offset + 8:offset + 8 + chunk_length]
+        if chunk_type == 0x4E4F534A:
+            gltf = json.loads(chunk)
+        elif chunk_type == 0x004E4942:
+            binary = chunk
+        offset += 8 + chunk_length
+
+    triangles = []
+    def visit(index, parent):
+        node = gltf['nodes'][index]
+        matrix = parent @ node_matrix(node)
+        for primitive in gltf['meshes'][node['mesh']]['primitives'] if 'mesh' in node else []:
+            if primitive.get('mode', 4) != 4:
+                continue
+            if 'KHR_draco_mesh_compression' in primitive.get('extensions', {}):
+                raise ValueError('Draco compressed meshes are not supported')
+            vertices = read_accessor(gltf, binary, primitive['attributes']['POSITION']).astype(np.float64)
+            vertices = vertices @ matrix[:3, :3].T + matrix[:3, 3]
+            if 'indices' in primitive:
+                indices = read_accessor(gltf, binary, primitive['indices']).reshape(-1).astype(np.int64)
+            else:
+                indices = np.arange(len(vertices))
+            triangles.append(vertices[indices[:len(indices) // 3 * 3]].reshape(-1, 3, 3))
+        for child in node.get('children', []):
+            visit(child, matrix)
+
+    for index in gltf['scenes'][gltf.get('scene', 0)]['nodes']:
+        visit(index, np.eye(4))
+    if not triangles:
+        return np.zeros((0, 3, 3))
+    triangles = np.concatenate(triangles)
+    return np.stack([triangles[..., 0], -triangles[..., 2], triangles[..., 1]], axis=-1)
+
+def vehicle_rotation(yaw, pitch, roll):
+    """
+    Rotation applied to a vehicle model by bpy_combine.py: successive rotations about
+    the global Z, X and Y axes. bpy.ops.transform.rotate turns by the opposite angle,
+    which also maps CARLA's left-handed angles to the Y-negated frame.
+    """
+    def axis_rotation(axis, angle):
+        c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+        i, j = [(1, 2), (2, 0), (0, 1)][axis]
+        matrix = np.eye(3)
+        matrix[i, i], matrix[i, j], matrix[j, i], matrix[j, j] = c, -s, s, c
+        return matrix
+    return axis_rotation(1, -roll) @ axis_rotation(0, -pitch) @ axis_rotation(2, -yaw)
+
+def vehicle_triangles(vehicle_ids, positions, rotations, vehicle_dir, cache):
+    """
+    Place the vehicle models of one frame like bpy_combine.py does.
+    Args:
+        vehicle_ids: Vehicle_ID (blueprint id) of every vehicle.
+        positions: (V, 3) [X, Y, Z] from the GPS file.
+        rotations: (V, 3) [Yaw, Pitch, Roll] from the GPS file.
+        vehicle_dir: Vehicle model folder.
+        cache: Dictionary of already loaded models, updated in place.
+    Returns:
+        (triangles, owner): (T, 3, 3) vertices and the row of the vehicle owning each triangle.
+    """
+    triangles, owner = [np.zeros((0, 3, 3))], [np.zeros(0, dtype=np.int64)]
+    for i, vehicle_id in enumerate(vehicle_ids):
+        if vehicle_id not in cache:
+            path = os.path.join(vehicle_dir, vehicle_id + '.glb')
+            cache[vehicle_id] = load_glb(path) if os.path.isfile(path) else np.zeros((0, 3, 3))
+        model = cache[vehicle_id]
+        triangles.append(model @ vehicle_rotation(*rotations[i]).T + positions[i])
+        owner.append(np.full(len(model), i, dtype=np.int64))
+    return np.concatenate(triangles), np.concatenate(owner)
+
+def intersect(origins, ends, v0, e1, e2, eps=1e-6):
+    """
+    Vectorized Moller-Trumbore intersection of segments with triangles (pairwise).
+    Args:
+        origins, ends: (N, 3) segment end points.
+        v0, e1, e2: (N, 3) triangle vertex and edges (v1 - v0, v2 - v0).
+        eps: Tolerance on the segment parameter, so hits at the end points are ignored.
+    Returns:
+        (hit, t): boolean (N,) and the segment parameter of the hit in [0, 1].
+    """
+    direction = ends - origins
+    pvec = np.cross(direction, e2)
+    det = np.einsum('ij,ij->i', e1, pvec)
+    valid = np.abs(det) > 1e-12
+    inv = np.where(valid, 1.0 / np.where(valid, det, 1.0), 0.0)
+    tvec = origins - v0
+    u = np.einsum('ij,ij->i', tvec, pvec) * inv
+    qvec = np.cross(tvec, e1)
+    v = np.einsum('ij,ij->i', direction, qvec) * inv
+    t = np.einsum('ij,ij->i', e2, qvec) * inv
+    hit = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > eps) & (t < 1 - eps)
+    return hit, t
+
+class UniformGrid:
+    """
+    Uniform XY grid over scene triangles for segment occlusion queries.
+    Every triangle is registered in the cells its (slightly enlarged) XY bounding box
+    overlaps; a segment is sampled every quarter cell so no candidate cell is missed.
+    """
+    def __init__(self, triangles, owner=None, cell=4.0):
+        self.triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+        self.owner = np.full(len(self.triangles), -1, dtype=np.int64) if owner is None else np.asarray(owner)
+        self.v0 = self.triangles[:, 0]
+        self.e1 = self.triangles[:, 1] - self.v0
+        self.e2 = self.triangles[:, 2] - self.v0
+        self.cell = cell
+        self.step = cell / 4
+
+        if len(self.triangles) == 0:
+            self.origin, self.shape = np.zeros(2), (0, 0)
+            self.cell_start = np.zeros(1, dtype=np.int64)
+            self.cell_triangles = np.zeros(0, dtype=np.int64)
+            return
+        margin = self.step / 2
+        low = self.triangles[:, :, :2].min(axis=1) - margin
+        high = self.triangles[:, :, :2].max(axis=1) + margin
+        self.origin = low.min(axis=0)
+        self.shape = tuple((np.floor((high.max(axis=0) - self.origin) / cell) + 1).astype(np.int64))
+        first = np.floor((low - self.origin) / cell).astype(np.int64)
+        last = np.floor((high - self.origin) / cell).astype(np.int64)
+        span = last - first + 1
+
+        # Expand every triangle into the cells of its bounding box
+        count = span[:, 0] * span[:, 1]
+        tri = np.repeat(np.arange(len(self.triangles)), count)
+        local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        cx = first[tri, 0] + local // span[tri, 1]
+        cy = first[tri, 1] + local % span[tri, 1]
+        cell_id = cx * self.shape[1] + cy
+        order = np.argsort(cell_id, kind='stable')
+        self.cell_triangles = tri[order]
+        self.cell_start = np.zeros(self.shape[0] * self.shape[1] + 1, dtype=np.int64)
+        np.add.at(self.cell_start, cell_id + 1, 1)
+        self.cell_start = np.cumsum(self.cell_start)
+
+    def candidates(self, origins, ends):
+        """
+        Get the (segment, triangle) pairs that may intersect.
+        Returns:
+            (segment, triangle) int64 arrays.
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if len(self.triangles) == 0 or len(origins) == 0:
+            return empty, empty
+        length = np.linalg.norm((ends - origins)[:, :2], axis=1)
+        samples = (np.ceil(length / self.step) + 1).astype(np.int64)
+        seg = np.repeat(np.arange(len(origins)), samples)
+        frac = (np.arange(samples.sum()) - np.repeat(np.cumsum(samples) - samples, samples)) / np.maximum(samples[seg] - 1, 1)
+        points = origins[seg, :2] + frac[:, None] * (ends - origins)[seg, :2]
+        cells = np.floor((points - self.origin) / self.cell).astype(np.int64)
+        inside = (cells[:, 0] >= 0) & (cells[:, 0] < self.shape[0]) & (cells[:, 1] >= 0) & (cells[:, 1] < self.shape[1])
+        seg = seg[inside]
+        cell_id = cells[inside, 0] * self.shape[1] + cells[inside, 1]
+        key = np.unique(seg * (self.shape[0] * self.shape[1]) + cell_id)
+        seg, cell_id = key // (self.shape[0] * self.shape[1]), key % (self.shape[0] * self.shape[1])
+
+        count = self.cell_start[cell_id + 1] - self.cell_start[cell_id]
+        pair_seg = np.repeat(seg, count)
+        local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        pair_tri = self.cell_triangles[np.repeat(self.cell_start[cell_id], count) + local]
+        key = np.unique(pair_seg * len(self.triangles) + pair_tri)
+        return key // len(self.triangles), key % len(self.triangles)
+
+    def blocked(self, origins, ends, ignore_triangle=None, ignore_owner=None, chunk=1 << 21):
+        """
+        Test which segments are blocked by a triangle of the grid.
+        Args:
+            origins, ends: (N, 3) segment end points.
+            ignore_triangle: (N,) triangle index of this grid to skip per segment (-1 for none).
+            ignore_owner: (N,) owner (vehicle row) whose triangles are skipped per segment (-1 for none).
+        Returns:
+            Boolean (N,) array.
+        """
+        result = np.zeros(len(origins), dtype=bool)
+        seg, tri = self.candidates(origins, ends)
+        if ignore_triangle is not None:
+            keep = tri != ignore_triangle[seg]
+            seg, tri = seg[keep], tri[keep]
+        if ignore_owner is not None:
+            keep = (self.owner[tri] < 0) | (self.owner[tri] != ignore_owner[seg])
+            seg, tri = seg[keep], tri[keep]
+        for start in range(0, len(seg), chunk):
+            s, t = seg[start:start + chunk], tri[start:start + chunk]
+            pending = ~result[s]  # segments already blocked need no more tests
+            s, t = s[pending], t[pending]
+            hit, _ = intersect(origins[s], ends[s], self.v0[t], self.e1[t], self.e2[t])
+            result[s[hit]] = True
+        return result
+
+def reflection_loss_db(cos_theta, fc, material=CONCRETE):
+    """
+    Reflection loss (dB) of an unpolarized wave, averaging the TE and TM Fresnel coefficients.
+    Args:
+        cos_theta: Cosine of the incidence angle (from the surface normal).
+        fc: Carrier frequency in Hz.
+        material: ITU-R P.2040 (a, b, c, d) parameters.
+    """
+    a, b, c, d = material
+    f_ghz = fc / 1e9
+    eta = a * f_ghz ** b - 1j * 17.98 * c * f_ghz ** d / f_ghz
+    cos_theta = np.clip(cos_theta, 0.0, 1.0)
+    root = np.sqrt(eta - (1 - cos_theta ** 2))
+    gamma_te = (cos_theta - root) / (cos_theta + root)
+    gamma_tm = (eta * cos_theta - root) / (eta * cos_theta + root)
+    power = (np.abs(gamma_te) ** 2 + np.abs(gamma_tm) ** 2) / 2
+    return -10 * np.log10(np.maximum(power, 1e-20))
+
+def angles(vectors):
+    """
+    Azimuth and elevation (degrees) of direction vectors, as in MATLAB comm.Ray.
+    """
+    azimuth = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0]))
+    elevation = np.degrees(np.arctan2(vectors[:, 2], np.linalg.norm(vectors[:, :2], axis=1)))
+    return np.stack([azimuth, elevation], axis=1)
+
+def trace(grids, tx, rx, rx_owner, fc=28e9, max_path_loss=120.0):
+    """
+    Trace the line-of-sight and first-order specular reflection paths.
+    Args:
+        grids: UniformGrid list forming the scene (e.g. static map and vehicles of the frame).
+        tx: Transmitter position [X, Y, Z].
+        rx: (R, 3) receiver positions.
+        rx_owner: (R,) vehicle row of each receiver, whose own triangles never block it.
+        fc: Carrier frequency in Hz.
+        max_path_loss: Paths with a larger path loss (dB) are dropped, like MaxAbsolutePathLoss.
+    Returns:
+        (P, 16) ray table in the export_rss.RAY_COLUMNS layout, with 1-based receiver indices.
+    """
+    tx = np.asarray(tx, dtype=np.float64)
+    rx = np.asarray(rx, dtype=np.float64).reshape(-1, 3)
+    rx_owner = np.asarray(rx_owner, dtype=np.int64)
+    wavelength = LIGHT_SPEED / fc
+    fspl = lambda distance: 20 * np.log10(4 * np.pi * np.maximum(distance, 1e-3) / wavelength)
+    rows = []
+
+    # Line of sight
+    origins = np.repeat(tx[None], len(rx), axis=0)
+    blocked = np.zeros(len(rx), dtype=bool)
+    for grid in grids:
+        blocked |= grid.blocked(origins, rx, ignore_owner=rx_owner)
+    distance = np.linalg.norm(rx - tx, axis=1)
+    los = np.flatnonzero(~blocked & (fspl(distance) <= max_path_loss))
+    for i in los:
+        rows.append(np.concatenate([[i + 1, fspl(distance[i])], angles((rx[i] - tx)[None])[0],
+                                    angles((tx - rx[i])[None])[0], [distance[i] / LIGHT_SPEED, 0, 1, 0],
+                                    np.full(6, np.nan)]))
+
+    # First-order reflections with the image method
+    for g, grid in enumerate(grids):
+        if len(grid.triangles) == 0:
+            continue
+        normal = np.cross(grid.e1, grid.e2)
+        area = np.linalg.norm(normal, axis=1)
+        keep = area > 1e-9
+        normal[keep] /= area[keep, None]
+        tx_side = np.einsum('ij,ij->i', tx - grid.v0, normal)
+        image = tx - 2 * tx_side[:, None] * normal
+        for r in range(len(rx)):
+            rx_side = np.einsum('ij,ij->i', rx[r] - grid.v0, normal)
+            cand = np.flatnonzero(keep & (tx_side * rx_side > 0) & (grid.owner != rx_owner[r]) &
+                                  (fspl(np.linalg.norm(rx[r] - image, axis=1)) <= max_path_loss))
+            if len(cand) == 0:
+                continue
+            hit, t = intersect(image[cand], np.repeat(rx[r][None], len(cand), axis=0),
+                               grid.v0[cand], grid.e1[cand], grid.e2[cand])
+            cand, t = cand[hit], t[hit]
+            points = image[cand] + t[:, None] * (rx[r] - image[cand])
+
+            # Coplanar triangles sharing an edge may report the same reflection point
+            _, first = np.unique(np.round(points, 2), axis=0, return_index=True)
+            cand, points = cand[first], points[first]
+
+            # Both legs must be unobstructed (the reflecting triangle itself excluded)
+            clear = np.ones(len(cand), dtype=bool)
+            owner = np.full(len(cand), rx_owner[r])
+            for h, other in enumerate(grids):
+                ignore = cand if h == g else None
+                clear &= ~other.blocked(np.repeat(tx[None], len(cand), axis=0), points,
+                                        ignore_triangle=ignore, ignore_owner=None)
+                clear &= ~other.blocked(points, np.repeat(rx[r][None], len(cand), axis=0),
+                                        ignore_triangle=ignore, ignore_owner=owner)
+            cand, points = cand[clear], points[clear]
+
+            length = np.linalg.norm(points - tx, axis=1) + np.linalg.norm(rx[r] - points, axis=1)
+            cos_theta = np.abs(np.einsum('ij,ij->i', rx[r] - points, normal[cand])) / \
+                        np.maximum(np.linalg.norm(rx[r] - points, axis=1), 1e-9)
+            path_loss = fspl(length) + reflection_loss_db(cos_theta, fc)
+            ok = path_loss <= max_path_loss
+            count = ok.sum()
+            if count:
+                rows.append(np.column_stack([
+                    np.full(count, r + 1), path_loss[ok], angles(points[ok] - tx), angles(points[ok] - rx[r]),
+                    length[ok] / LIGHT_SPEED, np.zeros(count), np.zeros(count), np.ones(count),
+                    points[ok], np.full((count, 3), np.nan)]))
+
+    if not rows:
+        return np.zeros((0, len(RAY_COLUMNS)))
+    ray_info = np.vstack([np.atleast_2d(row) for row in rows])
+    return ray_info[np.lexsort((ray_info[:, 1], ray_info[:, 0]))]
+
+def load_beam_weights(path=BEAM_WEIGHTS):
+    """
+    Load the beam tapers in the order used by network_simulate.m.
+    Returns:
+        (B, 8, 8) complex array.
+    """
+    weights = loadmat(path)['beam_weights'][0, 0]
+    return np.stack([w[0] for kind in ['single_beam', 'double_beam', 'triple_beam'] for w in weights[kind]])
+
+def ura_positions(size, spacing):
+    """
+    Element positions (meters) of a phased.URA: elements in the YZ plane, column-major order.
+    """
+    rows, cols = size
+    m, n = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+    y = (n - (cols - 1) / 2) * spacing
+    z = ((rows - 1) / 2 - m) * spacing
+    return np.stack([np.zeros(rows * cols), y.flatten(order='F'), z.flatten(order='F')], axis=1)
+
+def compute_rss(ray_info, num_vehicle, tapers, orientation, fc=28e9):
+    """
+    Compute list_RSS from a ray table, as network_simulate.m does.
+    Args:
+        ray_info: (P, 16) ray table (RAY_COLUMNS layout, 1-based vehicle index).
+        num_vehicle: Number of receivers.
+        tapers: (B, M, N) beam tapers of the base station URA.
+        orientation: Base station array orientation [az, el] added to the AoD.
+        fc: Carrier frequency in Hz.
+    Returns:
+        (num_vehicle + 1, B) RSS in dB; the last row is the per-beam average.
+    """
+    wavelength = LIGHT_SPEED / fc
+    tapers = np.asarray(tapers)
+    flat = tapers.reshape(len(tapers), -1, order='F')
+    positions = ura_positions(tapers.shape[1:], wavelength / 2)
+
+    incident = ray_info[:, 2:4] + np.asarray(orientation, dtype=np.float64)
+    incident[:, 0] = np.where(incident[:, 0] > 180, incident[:, 0] - 360, incident[:, 0])
+    incident[:, 0] = np.where(incident[:, 0] < -180, incident[:, 0] + 360, incident[:, 0])
+    az, el = np.radians(incident[:, 0]), np.radians(incident[:, 1])
+    direction = np.stack([np.cos(el) * np.cos(az), np.cos(el) * np.sin(az), np.sin(el)], axis=1)
+    steering = np.exp(2j * np.pi / wavelength * direction @ positions.T)
+    magnitude = 20 * np.log10(np.maximum(np.abs(steering @ flat.T), 1e-300))
+
+    linear = np.zeros((num_vehicle, len(tapers)))
+    np.add.at(linear, ray_info[:, 0].astype(np.int64) - 1, 10 ** ((magnitude - ray_info[:, 1:2]) / 10))
+    rss = np.full((num_vehicle + 1, len(tapers)), -200.0)
+    rss[:num_vehicle] = np.where(linear > 0, 10 * np.log10(np.where(linear > 0, linear, 1)), -200.0)
+    rss[num_vehicle] = rss[:num_vehicle].mean(axis=0) if num_vehicle else np.nan
+    return rss
+
+def base_station():
+    """
+    Transmitter position and array orientation, adjusted from config like netdata_alone.do_matlab.
+    """
+    location = list(config.GlobalConfig.bs_location)
+    rotation = list(config.GlobalConfig.bs_rotation)
+    location[1] *= -1
+    rotation[1] += 90
+    return np.array(location), np.array(rotation[1:], dtype=np.float64)
+
+def simulate_frame(gps_path, map_grid, vehicle_dir, cache, tapers, cell=4.0):
+    """
+    Trace one GPS frame and compute its RSS.
+    Returns:
+        (list_RSS, ray_info, stats) where stats holds the triangle count and trace time.
+    """
+    df = pd.read_csv(gps_path)
+    ids = df['Vehicle_ID'].to_numpy(dtype=str)
+    positions = df[['X', 'Y', 'Z']].to_numpy(dtype=np.float64)
+    rotations = df[['Yaw', 'Pitch', 'Roll']].to_numpy(dtype=np.float64)
+    rx = positions + np.stack([np.zeros(len(ids)), np.zeros(len(ids)),
+                               [VEHICLE_HEIGHT.get(v, DEFAULT_HEIGHT) for v in ids]], axis=1)
+    tx, orientation = base_station()
+
+    start = time.perf_counter()
+    triangles, owner = vehicle_triangles(ids, positions, rotations, vehicle_dir, cache)
+    grids = [map_grid, UniformGrid(triangles, owner, cell)]
+    ray_info = trace(grids, tx, rx, np.arange(len(ids)))
+    elapsed = time.perf_counter() - start
+    stats = {'triangles': len(map_grid.triangles) + len(triangles), 'receivers': len(ids),
+             'paths': len(ray_info), 'seconds': elapsed}
+    return compute_rss(ray_info, len(ids), tapers, orientation), ray_info, stats
+
+def simulate_episode(root, episode, map_grid, vehicle_dir, tapers, cell=4.0, save_rays=True):
+    """
+    Write _out_net (and _out_rays) results of one episode with the NumPy backend.
+    Frames that already have a network result are skipped, and only the keyframes are
+    traced when keyframe.py selected them, like network_simulate.m.
+    """
+    gps_dir = os.path.join(root, '_out_gps', episode)
+    net_dir = os.path.join(root, '_out_net', episode)
+    ray_dir = os.path.join(root, '_out_rays', episode)
+    for folder in [net_dir] + ([ray_dir] if save_rays else []):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    cache, total = {}, {'frames': 0, 'triangles': 0, 'receivers': 0, 'paths': 0, 'seconds': 0.0}
+    keyframes = read_keyframes(net_dir)
+    for frame in list_frames(gps_dir, '.csv'):
+        if keyframes is not None and '%06d.csv' % frame not in keyframes:
+            continue
+        name = '%06d.csv.mat' % frame
+        if os.path.isfile(os.path.join(net_dir, name)):
+            print(name[:-4] + ' already exists.')
+            continue
+        list_RSS, ray_info, stats = simulate_frame(os.path.join(gps_dir, '%06d.csv' % frame),
+                                                   map_grid, vehicle_dir, cache, tapers, cell)
+        savemat(os.path.join(net_dir, name), {'list_RSS': list_RSS})
+        if save_rays:
+            savemat(os.path.join(ray_dir, name), {'ray_info': ray_info}, do_compression=True)
+        print('Done and Save: %s (%d paths, %.3f s)' % (os.path.join(net_dir, name), stats['paths'], stats['seconds']))
+        total['frames'] += 1
+        for key in stats:
+            total[key] += stats[key]
+    report_throughput(total)
+    return total
+
+def validate_episode(root, episode, map_grid, vehicle_dir, tapers, cell=4.0, num_frames=20, top_k=3):
+    """
+    Compare the NumPy backend with the stored MATLAB results of an episode.
+    Reports the RSS error, the best-beam agreement and, when the _out_rays sidecar
+    exists, the error of the RSS computed from the MATLAB rays (RSS model only).
+    """
+    gps_dir = os.path.join(root, '_out_gps', episode)
+    net_dir = os.path.join(root, '_out_net', episode)
+    ray_dir = os.path.join(root, '_out_rays', episode)
+    frames = list_frames(net_dir, '.csv.mat')
+    frames = frames[np.linspace(0, len(frames) - 1, min(num_frames, len(frames))).astype(np.int64)] if len(frames) else frames
+
+    cache, total = {}, {'frames': 0, 'triangles': 0, 'receivers': 0, 'paths': 0, 'seconds': 0.0}
+    trace_error, model_error, best_match, top_match, counts = [], [], [], [], []
+    for frame in frames:
+        reference, interpolated = read_network(os.path.join(net_dir, '%06d.csv.mat' % frame))
+        if interpolated:
+            print('%06d: interpolated by keyframe.py, skipped' % frame)
+            continue
+        reference = reference[:-1]
+        list_RSS, ray_info, stats = simulate_frame(os.path.join(gps_dir, '%06d.csv' % frame),
+                                                   map_grid, vehicle_dir, cache, tapers, cell)
+        predicted = list_RSS[:-1]
+        if predicted.shape != reference.shape:
+            print('%06d: vehicle count mismatch, skipped' % frame)
+            continue
+        total['frames'] += 1
+        for key in stats:
+            total[key] += stats[key]
+        trace_error.append(np.abs(predicted - reference).ravel())
+        best = beam_labels(reference, 1)[0][:, 0]
+        best_match.append(beam_labels(predicted, 1)[0][:, 0] == best)
+        top_match.append((beam_labels(predicted, top_k)[0] == best[:, None]).any(axis=1))
+
+        ray_path = os.path.join(ray_dir, '%06d.csv.mat' % frame)
+        if os.path.isfile(ray_path):
+            matlab_rays = loadmat(ray_path, variable_names=['ray_info'])['ray_info'].reshape(-1, len(RAY_COLUMNS))
+            model_error.append(np.abs(compute_rss(matlab_rays, len(reference), tapers, base_station()[1])[:-1] - reference).ravel())
+            counts.append([len(matlab_rays), len(ray_info)])
+
+    if not trace_error:
+        print('No MATLAB results to validate against in %s' % net_dir)
+        return
+    print('Validated %d frames of %s' % (total['frames'], episode))
+    print('  RSS absolute error: mean %.2f dB, median %.2f dB' %
+          (np.mean(np.concatenate(trace_error)), np.median(np.concatenate(trace_error))))
+    print('  Best beam agreement: %.1f %%, in NumPy top-%d: %.1f %%' %
+          (100 * np.mean(np.concatenate(best_match)), top_k, 100 * np.mean(np.concatenate(top_match))))
+    if model_error:
+        print('  RSS error from MATLAB rays (RSS model only): mean %.3f dB' % np.mean(np.concatenate(model_error)))
+        print('  Paths per frame: MATLAB %.1f, NumPy %.1f' % tuple(np.mean(counts, axis=0)))
+    report_throughput(total)
+    return
+
+def report_throughput(total):
+    if total['frames'] == 0:
+        return
+    print('Throughput: %d frames, %.0f triangles and %.1f receivers per frame, %.3f s per frame, %.0f receiver-triangle pairs/s' %
+          (total['frames'], total['triangles'] / total['frames'], total['receivers'] / total['frames'],
+           total['seconds'] / total['frames'], total['triangles'] / total['frames'] * total['receivers'] / max(total['seconds'], 1e-9)))
+
+def main():
+    """
+    Run the NumPy ray tracing backend on every episode (or validate it against MATLAB results).
+    """
+    argparser = argparse.ArgumentParser(description='Approximate ray tracing (LOS and first-order reflections) without MATLAB')
+    argparser.add_argument('-e', '--episode', metavar='E', action='append', help='Episode folder (default: all)')
+    argparser.add_argument('--cell', metavar='C', default=4.0, type=float, help='Grid cell size in meters (default: 4)')
+    argparser.add_argument('--no-rays', action='store_true', help='Do not save the _out_rays ray tables')
+    argparser.add_argument('--validate', action='store_true', help='Compare with the stored MATLAB results instead of saving')
+    argparser.add_argument('-n', '--num-frames', metavar='N', default=20, type=int, help='Frames per episode to validate (default: 20)')
+    args = argparser.parse_args()
+
+    root = config.GlobalConfig.SAVE_ROOT
+    start = time.perf_counter()
+    map_grid = UniformGrid(load_glb(os.path.join(MODEL_ROOT, config.GlobalConfig.MAP_MODEL)), cell=args.cell)
+    print('Loaded %s: %d triangles in %.2f s' % (config.GlobalConfig.MAP_MODEL, len(map_grid.triangles), time.perf_counter() - start))
+    vehicle_dir = os.path.join(MODEL_ROOT, config.GlobalConfig.VEHICLE_MODEL_DIR)
+    tapers = load_beam_weights()
+
+    for episode in args.episode or list_episodes(root):
+        if args.validate:
+            validate_episode(root, episode, map_grid, vehicle_dir, tapers, args.cell, args.num_frames)
+        else:
+            simulate_episode(root, episode, map_grid, vehicle_dir, tapers, args.cell, not args.no_rays)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,9 @@ import time
 import carla
 import argparse
 import logging
+import numpy as np
 from numpy import random
+import trajectory
 
 def clean_objects(world):
     """
@@ -102,6 +104,98 @@ def get_actor_blueprints(world, filter, generation):
         print("   Warning! Actor Generation is not valid. No actor will be spawned.")
         return []
 
+def record_tick(world, recorder, vehicles_list):
+    """
+    Record the transform of every spawned vehicle at the current tick.
+    Args:
+        world: The CARLA world object.
+        recorder: A trajectory.TrajectoryRecorder.
+        vehicles_list: Ids of the spawned vehicles.
+    """
+    snapshot = world.get_snapshot()
+    actor_ids, transforms = [], []
+    for actor_id in vehicles_list:
+        actor_snapshot = snapshot.find(actor_id)
+        if actor_snapshot is None:
+            continue
+        transform = actor_snapshot.get_transform()
+        actor_ids.append(actor_id)
+        transforms.append([transform.location.x, transform.location.y, transform.location.z,
+                           transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll])
+    recorder.record(snapshot.frame, snapshot.timestamp.elapsed_seconds, actor_ids, transforms)
+    return
+
+def replay_trajectory(client, world, trace, vehicles_list, synchronous_master, asynch):
+    """
+    Drive vehicles from a recorded trajectory instead of the Traffic Manager.
+    Vehicles are spawned without physics when they first appear, teleported every tick
+    with one batch of ApplyTransform commands and destroyed after their last appearance.
+    The trajectory row is the last recorded frame not after the world frame, both counted
+    from their start, so the replay keeps the recorded speed when another client ticks the
+    world during recording or replay.
+    Args:
+        client: The CARLA client object.
+        world: The CARLA world object.
+        trace: Dictionary returned by trajectory.load_trajectory.
+        vehicles_list: List updated in place with the ids of the live vehicles.
+        synchronous_master: Whether this client ticks the world.
+        asynch: Whether the simulation runs in asynchronous mode.
+    """
+    def to_transform(values):
+        return carla.Transform(carla.Location(x=float(values[0]), y=float(values[1]), z=float(values[2])),
+                               carla.Rotation(pitch=float(values[3]), yaw=float(values[4]), roll=float(values[5])))
+
+    bp_lib = world.get_blueprint_library()
+    alive = ~np.isnan(trace['transform'][:, :, 0])
+    spawned = {}  # trajectory column -> actor id
+    failed = set()
+    recorded = trace['frame'] - trace['frame'][0]
+    start_frame = world.get_snapshot().frame
+
+    while True:
+        # Follow the world frame, the recording may skip the frames ticked by other clients
+        elapsed = world.get_snapshot().frame - start_frame
+        if elapsed > recorded[-1]:
+            break
+        row = np.searchsorted(recorded, elapsed, side='right') - 1
+
+        # Spawn the live vehicles that are not in the world yet, retrying failed spawns
+        batch, columns = [], []
+        for column in np.flatnonzero(alive[row]):
+            if column in spawned:
+                continue
+            blueprint = bp_lib.find(str(trace['type_id'][column]))
+            if trace['color'][column] and blueprint.has_attribute('color'):
+                blueprint.set_attribute('color', str(trace['color'][column]))
+            blueprint.set_attribute('role_name', 'autopilot')
+            batch.append(carla.command.SpawnActor(blueprint, to_transform(trace['transform'][row, column]))
+                .then(carla.command.SetSimulatePhysics(carla.command.FutureActor, False)))
+            columns.append(column)
+        for column, response in zip(columns, client.apply_batch_sync(batch, False)):
+            if response.error:
+                if column not in failed:
+                    logging.error(response.error)
+                    failed.add(column)
+            else:
+                spawned[column] = response.actor_id
+                vehicles_list.append(response.actor_id)
+
+        # Destroy the vehicles that are no longer in the trajectory
+        gone = [column for column in spawned if not alive[row, column]]
+        client.apply_batch([carla.command.DestroyActor(spawned[column]) for column in gone])
+        for column in gone:
+            vehicles_list.remove(spawned.pop(column))
+
+        # Teleport all the live vehicles at once
+        client.apply_batch([carla.command.ApplyTransform(actor_id, to_transform(trace['transform'][row, column]))
+                            for column, actor_id in spawned.items()])
+
+        if not asynch and synchronous_master:
+            world.tick()
+        else:
+            world.wait_for_tick()
+    return
+
 def main():
     """
     Main function to initialize the CARLA simulation, configure the environment, and spawn actors.
@@ -200,12 +294,24 @@ def main():
         action='store_true',
         default=False,
         help='Activate no rendering mode')
+    mode = argparser.add_mutually_exclusive_group()
+    mode.add_argument(
+        '--record',
+        metavar='PATH',
+        default=None,
+        help='Record the trajectory of every vehicle to a .npz file')
+    mode.add_argument(
+        '--replay',
+        metavar='PATH',
+        default=None,
+        help='Replay a recorded trajectory instead of running the Traffic Manager')
 
     args = argparser.parse_args()
 
     logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
     vehicles_list = []
+    recorder = trajectory.TrajectoryRecorder() if args.record else None
     client = carla.Client(args.host, args.port)
     client.set_timeout(10.0)
     synchronous_master = False
@@ -246,6 +352,12 @@ def main():
             settings.no_rendering_mode = True
         world.apply_settings(settings)
 
+        if args.replay:
+            print('replaying %s, press Ctrl+C to exit.' % args.replay)
+            replay_trajectory(client, world, trajectory.load_trajectory(args.replay),
+                              vehicles_list, synchronous_master, args.asynch)
+            return
+
         # Retrieve and filter blueprints for vehicles and pedestrians
         blueprints = get_actor_blueprints(world, args.filterv, args.generationv)
         if not blueprints:
@@ -307,6 +419,10 @@ def main():
             else:
                 vehicles_list.append(response.actor_id)
 
+        if recorder is not None:
+            for actor in world.get_actors(vehicles_list):
+                recorder.add_actor(actor.id, actor.type_id, actor.attributes.get('color', ''))
+
         # Enable automatic vehicle lights if specified
         if args.car_lights_on:
             all_vehicle_actors = world.get_actors(vehicles_list)
@@ -324,8 +440,13 @@ def main():
                 world.tick()
             else:
                 world.wait_for_tick()
+            if recorder is not None:
+                record_tick(world, recorder, vehicles_list)
 
     finally:
+        if recorder is not None:
+            recorder.save(args.record)
+
         # Clean up and destroy all spawned vehicles
         if not args.asynch and synchronous_master:
             settings = world.get_settings()
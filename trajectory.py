@@ -0,0 +1,142 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import config
+
+class TrajectoryRecorder:
+    """
+    Collect the per-tick transform of every vehicle during a traffic run.
+    Transforms are stored as [x, y, z, pitch, yaw, roll] in CARLA coordinates.
+    """
+    def __init__(self):
+        self.frames = []
+        self.timestamps = []
+        self.ticks = []
+        self.actors = {}  # actor id -> (type id, color)
+
+    def add_actor(self, _actor_id, _type_id, _color=''):
+        """
+        Register a vehicle so it can be respawned identically during replay.
+        Args:
+            _actor_id: CARLA actor id.
+            _type_id: Blueprint id (e.g. 'vehicle.audi.a2').
+            _color: Value of the blueprint 'color' attribute, if any.
+        """
+        self.actors[_actor_id] = (_type_id, _color)
+
+    def record(self, _frame, _timestamp, _actor_ids, _transforms):
+        """
+        Record one tick.
+        Args:
+            _frame: World frame number.
+            _timestamp: Simulation time in seconds.
+            _actor_ids: Ids of the vehicles alive at this tick.
+            _transforms: (N, 6) array of [x, y, z, pitch, yaw, roll], one row per id.
+        """
+        self.frames.append(_frame)
+        self.timestamps.append(_timestamp)
+        self.ticks.append((np.asarray(_actor_ids, dtype=np.int64),
+                           np.asarray(_transforms, dtype=np.float32).reshape(-1, 6)))
+
+    def save(self, _path):
+        """
+        Save the trajectory as a compressed .npz file.
+        The transform array is (tick, vehicle, 6) and NaN where a vehicle is not alive.
+        """
+        actor_ids = np.array(sorted(self.actors), dtype=np.int64)
+        transforms = np.full((len(self.frames), len(actor_ids), 6), np.nan, dtype=np.float32)
+        for i, (ids, values) in enumerate(self.ticks):
+            columns = np.searchsorted(actor_ids, ids)
+            known = (columns < len(actor_ids)) & (actor_ids[np.minimum(columns, len(actor_ids) - 1)] == ids)
+            transforms[i, columns[known]] = values[known]
+        if os.path.dirname(_path) and not os.path.isdir(os.path.dirname(_path)):
+            os.makedirs(os.path.dirname(_path))
+        np.savez_compressed(
+            _path,
+            frame=np.array(self.frames, dtype=np.int64),
+            timestamp=np.array(self.timestamps, dtype=np.float64),
+            actor_id=actor_ids,
+            type_id=np.array([self.actors[a][0] for a in actor_ids], dtype=str),
+            color=np.array([self.actors[a][1] for a in actor_ids], dtype=str),
+            transform=transforms,
+        )
+        print('Saved %d ticks of %d vehicles to %s' % (len(self.frames), len(actor_ids), _path))
+        return
+
+def load_trajectory(_path):
+    """
+    Load a trajectory saved by TrajectoryRecorder.
+    Returns:
+        Dictionary with 'frame', 'timestamp', 'actor_id', 'type_id', 'color' and 'transform'.
+    """
+    with np.load(_path) as trajectory:
+        return {key: trajectory[key] for key in trajectory.files}
+
+def export_gps(_trajectory, _root, _episode, _step=2, _x=None, _y=None, _max_step=None):
+    """
+    Write _out_gps files from a recorded trajectory without a CARLA server.
+    Follows generate_data.save_image_gps: one CSV per captured frame with the
+    vehicles inside the map region, Y negated, stopping at _max_step frames or at
+    the first frame without any vehicle in the region.
+    Args:
+        _trajectory: Dictionary returned by load_trajectory.
+        _root: Root directory of the dataset.
+        _episode: Episode folder name.
+        _step: Number of world frames between captures (sensor_tick / fixed_delta_seconds).
+        _x: X range of the map region (default: config.GlobalConfig.MAP_X).
+        _y: Y range of the map region (default: config.GlobalConfig.MAP_Y).
+        _max_step: Maximum number of frames (default: config.GlobalConfig.MAX_STEP).
+    Returns:
+        Number of frames written.
+    """
+    _x = config.GlobalConfig.MAP_X if _x is None else _x
+    _y = config.GlobalConfig.MAP_Y if _y is None else _y
+    _max_step = config.GlobalConfig.MAX_STEP if _max_step is None else _max_step
+
+    gps_dir = os.path.join(_root, '_out_gps', _episode)
+    if not os.path.isdir(gps_dir):
+        os.makedirs(gps_dir)
+
+    # Select by frame number, the recording may skip the frames ticked by other clients
+    captured = (_trajectory['frame'] - _trajectory['frame'][0]) % _step == 0
+    transforms = _trajectory['transform'][captured]
+    frames = _trajectory['frame'][captured]
+    timestamps = _trajectory['timestamp'][captured]
+    x, y = transforms[:, :, 0], -transforms[:, :, 1]
+    inside = (_x[0] < x) & (x < _x[1]) & (_y[0] < y) & (y < _y[1])
+
+    count = 0
+    for i in range(len(frames)):
+        if count == _max_step or not inside[i].any():
+            break
+        pose = transforms[i, inside[i]]
+        pd.DataFrame({
+            "Timestamp": timestamps[i],
+            "Vehicle_ID": _trajectory['type_id'][inside[i]],
+            "X": pose[:, 0],
+            "Y": -pose[:, 1],
+            "Z": pose[:, 2],
+            "Yaw": pose[:, 4],
+            "Pitch": pose[:, 3],
+            "Roll": pose[:, 5],
+        }).to_csv(os.path.join(gps_dir, '%06d.csv' % frames[i]), index=False)
+        count += 1
+    print('Wrote %d GPS frames to %s' % (count, gps_dir))
+    return count
+
+def main():
+    """
+    Generate the GPS data of an episode from a recorded trajectory.
+    """
+    argparser = argparse.ArgumentParser(description='Generate GPS data from a recorded trajectory')
+    argparser.add_argument('trajectory', help='Trajectory file recorded with start_carla.py --record')
+    argparser.add_argument('-e', '--episode', metavar='E', default=config.GlobalConfig.EPI_NAME.strip('/'), help='Episode folder name (default: from config)')
+    argparser.add_argument('--step', metavar='S', default=2, type=int, help='World frames between captured frames (default: 2, i.e. sensor_tick 0.1 at 20 FPS)')
+    args = argparser.parse_args()
+
+    export_gps(load_trajectory(args.trajectory), config.GlobalConfig.SAVE_ROOT, args.episode, args.step)
+    return
+
+if __name__ == '__main__':
+    main()